@@ -0,0 +1,185 @@
+"""
+Helpers for writing records to local batch files referenced by Singer BATCH messages.
+"""
+
+import gzip
+from dataclasses import dataclass
+
+import simplejson as json
+from singer_sdk.helpers._batch import BaseBatchFileEncoding
+
+
+JSONL_MAX_RECORDS = 1000000
+JSONL_MAX_BYTES = 256 * 1024 * 1024
+PARQUET_MAX_RECORDS = 100000
+PARQUET_MAX_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class ParquetEncoding(BaseBatchFileEncoding):
+    """Parquet encoding for batch files. Requires the `parquet` extra to be installed."""
+
+    __encoding_format__ = "parquet"
+
+
+def is_parquet(encoding):
+    return encoding.format == ParquetEncoding.__encoding_format__
+
+
+def json_line(record):
+    """Returns a record serialized as a JSON line, and its size in bytes."""
+    line = (json.dumps(record, use_decimal=True, default=str) + "\n").encode()
+    return line, len(line)
+
+
+def split_records(records, max_records, max_bytes, encode=json_line):
+    """
+    Splits records into batches holding at most max_records records and
+    max_bytes bytes without buffering them. encode(record) returns the
+    (item, size) to batch for each record. Yields an iterator of items per
+    batch, which must be consumed before the next batch is requested.
+    """
+    records = iter(records)
+    # The item pulled past the end of the previous batch, which starts the next one
+    pending = []
+
+    def items():
+        count, size = 0, 0
+        while True:
+            if pending:
+                item, item_size = pending.pop()
+            else:
+                try:
+                    item, item_size = encode(next(records))
+                except StopIteration:
+                    return
+            if count and (count >= max_records or size + item_size > max_bytes):
+                pending.append((item, item_size))
+                return
+            count += 1
+            size += item_size
+            yield item
+
+    while True:
+        if not pending:
+            try:
+                pending.append(encode(next(records)))
+            except StopIteration:
+                return
+        yield items()
+
+
+def chunk_records(records, max_records, max_bytes, encode=json_line):
+    """Like split_records, but yields each batch as a list of items."""
+    for items in split_records(records, max_records, max_bytes, encode):
+        yield list(items)
+
+
+def batch_limits(config, encoding):
+    """
+    Returns the (max_records, max_bytes) of each batch file. Parquet rows are
+    buffered until their file is written, so their defaults are smaller.
+    """
+    if is_parquet(encoding):
+        defaults = PARQUET_MAX_RECORDS, PARQUET_MAX_BYTES
+    else:
+        defaults = JSONL_MAX_RECORDS, JSONL_MAX_BYTES
+    return config.get('batch_max_records') or defaults[0], config.get('batch_max_bytes') or defaults[1]
+
+
+def batch_file_extension(encoding):
+    if is_parquet(encoding):
+        return "parquet"
+    if encoding.compression == "gzip":
+        return "json.gz"
+    return "json"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("The parquet batch encoding requires pyarrow. "
+                           "Please install tap-dynamodb with the `parquet` extra")
+    return pyarrow
+
+
+def _json_type(property_schema):
+    """Returns the first non-null JSON schema type of a property."""
+    types = property_schema.get("type", "string")
+    if isinstance(types, str):
+        types = [types]
+    return next((json_type for json_type in types if json_type != "null"), "string")
+
+
+def parquet_schema(schema):
+    """
+    Returns the pyarrow schema for a stream's JSON schema, so every batch file
+    of the stream has the same columns and types. Objects and arrays are
+    stored as JSON strings.
+    """
+    pyarrow = _import_pyarrow()
+    types = {
+        "integer": pyarrow.int64(),
+        "number": pyarrow.float64(),
+        "boolean": pyarrow.bool_(),
+    }
+    return pyarrow.schema([
+        (name, types.get(_json_type(property_schema), pyarrow.string()))
+        for name, property_schema in schema.get("properties", {}).items()
+    ])
+
+
+def parquet_row_encoder(schema):
+    """
+    Returns an encode function for chunk_records which converts records to
+    rows matching parquet_schema(schema). Sizes are estimated from the values
+    instead of serializing each record.
+    """
+    converters = {
+        "integer": int,
+        "number": float,
+        "boolean": bool,
+        "string": str,
+    }
+    columns = [
+        (name, converters.get(_json_type(property_schema)))
+        for name, property_schema in schema.get("properties", {}).items()
+    ]
+
+    def encode(record):
+        row, size = {}, 0
+        for name, convert in columns:
+            value = record.get(name)
+            if value is not None:
+                if convert is None:
+                    value = json.dumps(value, use_decimal=True, default=str)
+                elif not (convert is str and isinstance(value, str)):
+                    value = convert(value)
+                size += len(value) if isinstance(value, str) else 8
+            row[name] = value
+        return row, size
+
+    return encode
+
+
+def write_batch_file(f, encoding, items, schema=None):
+    """
+    Writes a single batch to the open binary file f using the given encoding.
+    items are JSON lines, which are written as they are iterated, or parquet
+    rows along with the pyarrow schema.
+    """
+    if is_parquet(encoding):
+        write_parquet(f, items, schema, encoding.compression)
+    elif encoding.compression == "gzip":
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            gz.writelines(items)
+    else:
+        f.writelines(items)
+
+
+def write_parquet(f, rows, schema, compression):
+    pyarrow = _import_pyarrow()
+    table = pyarrow.Table.from_pylist(rows, schema=schema)
+    pyarrow.parquet.write_table(table, f, compression=compression or "none")
@@ -3,12 +3,21 @@ Custom client handling, including DynamoDBStream base class.+
 Taken heavily from https://github.com/singer-io/tap-dynamodb/blob/master/tap_dynamodb/sync_strategies/log_based.py
 """
 
+import copy
+import itertools
 from typing import Optional, Iterable
+from uuid import uuid4
 
+import simplejson as json
 import singer
+from singer_sdk._singerlib import StateMessage, write_message
 from singer_sdk.streams import Stream
 
 from tap_dynamodb.sync_strategies import full_table, log_based
+from tap_dynamodb import batch
+from tap_dynamodb.digest_index import DigestIndex
+from tap_dynamodb.scheduler import OUTPUT_LOCK, STATE_LOCK
+from tap_dynamodb.spill_cache import SpillCache
 from tap_dynamodb.deserialize import Deserializer
 from tap_dynamodb import dynamodb
 from tap_dynamodb.schema import flatten_json
@@ -17,6 +26,32 @@ from tap_dynamodb.schema import flatten_json
 class DynamoDBStream(Stream):
     """Stream class for DynamoDB streams."""
 
+    def _write_record_message(self, record: dict) -> None:
+        with OUTPUT_LOCK:
+            super()._write_record_message(record)
+
+    def _write_schema_message(self) -> None:
+        with OUTPUT_LOCK:
+            super()._write_schema_message()
+
+    def _write_batch_message(self, encoding, manifest) -> None:
+        with OUTPUT_LOCK:
+            super()._write_batch_message(encoding, manifest)
+
+    def _write_state_message(self) -> None:
+        """Write out a STATE message with this stream's bookmarks and those last emitted by other streams.
+
+        Other streams' bookmarks may be ahead of the records they have written, for example
+        while a batch file is being filled, so they are only included once those streams
+        emit them. Only this stream's sync changes its own bookmarks, which are written
+        after the records they cover have been yielded.
+        """
+        with STATE_LOCK:
+            bookmarks = self._tap.emitted_bookmarks
+            bookmarks[self.name] = copy.deepcopy(self.stream_state)
+            with OUTPUT_LOCK:
+                write_message(StateMessage(value={**self.tap_state, 'bookmarks': bookmarks}))
+
     def get_records(self, context: Optional[dict]) -> Iterable[dict]:
         """Return a generator of row-type dictionary objects.
 
@@ -26,35 +61,278 @@ class DynamoDBStream(Stream):
         """
 
         if self.replication_method == "FULL_TABLE":
-            for record in self.full_table_get_records():
+            if self.table_config.get('change_detection'):
+                records = self.change_detection_get_records()
+            else:
+                records = self.full_table_get_records()
+            for record in records:
                 yield record
 
         elif self.replication_method == "LOG_BASED":
-            if log_based.has_stream_aged_out(self.tap_state, self.name):
+            if self.table_config.get('filter_expression'):
+                # Stream records can only be matched against the key slice
+                raise ValueError(f'filter_expression is not supported for LOG_BASED replication of {self.name}, '
+                                 f'only partition_key_values and sort_key_range are')
+
+            # An unfinished initial scan has no success_timestamp yet, and its resume bookmarks must be kept
+            if singer.get_bookmark(self.tap_state, self.name, 'initial_full_table_complete') and \
+                    log_based.has_stream_aged_out(self.tap_state, self.name):
                 self.logger.info("Clearing state because stream has aged out")
-                self.tap_state.get('bookmarks', {}).pop(self.name)
+                self.stream_state.clear()
 
             if not singer.get_bookmark(self.tap_state, self.name, 'initial_full_table_complete'):
                 self.logger.info(f'Must complete full table sync before replicating '
                                  f'from dynamodb streams for {self.name}')
+                # Mark the shards closed before the scan as finished, since
+                # their changes are already reflected in the scanned items
+                log_based.get_initial_bookmarks(self.config, self.tap_state, self.name)
+
                 for record in self.full_table_get_records():
                     yield record
 
-            # TODO: test log-based replication
+                singer.write_bookmark(self.tap_state, self.name, 'initial_full_table_complete', True)
+
             for record in self.log_based_get_records():
                 yield record
 
+            singer.write_bookmark(self.tap_state, self.name, 'success_timestamp',
+                                  singer.utils.strftime(singer.utils.now()))
+
         else:
             self.logger.info(f'Unknown replication method: {self.replication_method} for stream: {self.name}')
 
+    def get_batches(self, batch_config, context=None):
+        """Write records to local batch files, yielding an (encoding, manifest) tuple per file.
+
+        Files are capped at `batch_max_records` records and `batch_max_bytes` bytes of
+        uncompressed JSON, or of estimated column data for parquet, whose rows are
+        buffered until each file is written.
+        """
+        sync_id = f"{self.tap_name}--{self.name}-{uuid4()}"
+        prefix = batch_config.storage.prefix or ""
+        extension = batch.batch_file_extension(batch_config.encoding)
+
+        schema, encode = None, batch.json_line
+        if batch.is_parquet(batch_config.encoding):
+            # Every file shares the schema of the stream rather than one inferred from its batch
+            stream_schema = self.stream_maps[0].transformed_schema
+            schema = batch.parquet_schema(stream_schema)
+            encode = batch.parquet_row_encoder(stream_schema)
+
+        # Run records through the same mapping and type conformance as RECORD messages
+        records = (
+            record_message.record
+            for record in self._sync_records(context, write_messages=False)
+            for record_message in self._generate_record_messages(record)
+        )
+        max_records, max_bytes = batch.batch_limits(self.config, batch_config.encoding)
+        if schema is not None:
+            chunks = batch.chunk_records(records, max_records, max_bytes, encode)
+        else:
+            # JSON lines are streamed into each file rather than buffered
+            chunks = batch.split_records(records, max_records, max_bytes, encode)
+
+        for i, chunk in enumerate(chunks, start=1):
+            filename = f"{prefix}{sync_id}-{i}.{extension}"
+            with batch_config.storage.fs(writeable=True, create=True) as fs:
+                with fs.open(filename, "wb") as f:
+                    batch.write_batch_file(f, batch_config.encoding, chunk, schema)
+                file_url = fs.geturl(filename)
+
+            yield batch_config.encoding, [file_url]
+
+    @property
+    def table_config(self) -> dict:
+        """Return the `table_configs` entry for this stream, if any."""
+        return self.config.get('table_configs', {}).get(self.name, {})
+
+    def describe_table(self) -> dict:
+        client = dynamodb.get_client(self.config)
+        return client.describe_table(TableName=self.name)['Table']
+
     def full_table_get_records(self):
-        results = full_table.scan_table(self.name, self.orig_projection, None, self.config, False)
+        if self.config.get('spill_cache_dir'):
+            results = self.spill_cache_results()
+        else:
+            results = self.full_table_get_results()
+
         for result in results:
             for item in result.get('Items', []):
                 record = Deserializer().deserialize_item(item)
                 flat_record = flatten_json(record, self.config.get('except_keys', []))
                 yield flat_record
 
+    def full_table_get_results(self, last_evaluated_key=None):
+        """
+        Yields the Scan or Query result pages of the table. A scan starts after
+        last_evaluated_key, while queries resume from the partition bookmarks.
+        """
+        table_config = self.table_config
+        if table_config.get('partition_key_values'):
+            return self.query_get_results(self.describe_table(), table_config)
+
+        filter_params = full_table.build_scan_params(self.describe_table(), table_config) \
+            if table_config else None
+        return full_table.scan_table(self.name, self.orig_projection, last_evaluated_key, self.config, False,
+                                     filter_params=filter_params)
+
+    def change_detection_get_records(self):
+        """
+        Scans the full table but only yields items which were inserted or
+        changed since the last sync, followed by deletion records for items
+        which have disappeared. Comparison uses a local digest index.
+
+        The `digest_run_id` bookmark names the index run the target has
+        received, which is the baseline for the next sync. It is only updated
+        in the state emitted after this run's records.
+        """
+        index = DigestIndex(self.config.get('digest_index_dir', '.tap_dynamodb'), self.name,
+                            singer.get_bookmark(self.tap_state, self.name, 'digest_run_id'))
+        try:
+            records = self.full_table_get_records()
+            while True:
+                chunk = list(itertools.islice(records, 1000))
+                if not chunk:
+                    break
+                for record in index.filter_changed(chunk, self.primary_keys):
+                    yield record
+
+            deleted_at = singer.utils.strftime(singer.utils.now())
+            for record in index.deleted(self.primary_keys):
+                record["_sdc_deleted_at"] = deleted_at
+                yield record
+
+            index.commit()
+            singer.write_bookmark(self.tap_state, self.name, 'digest_run_id', index.run_id)
+        finally:
+            index.close()
+
+    def spill_cache_results(self):
+        """
+        Yields the table's result pages while spilling them to the local spill
+        cache, or replays them from it.
+
+        The `spill_cache_run` bookmark names the run being spilled. A sync
+        started from a state naming a run replays the pages that run spilled,
+        then continues the scan or query from the checkpoint after its last
+        spilled page. Queries resuming from partition bookmarks of a run which
+        is not cached only fetch part of the table, so they are not spilled.
+        """
+        table_name = self.name
+        state = self.tap_state
+        stream_state = self.stream_state
+        cache = SpillCache(self.config['spill_cache_dir'],
+                           self.config.get('spill_cache_retention_hours', 24),
+                           self.config.get('spill_cache_max_mb', 10240) * 1024 * 1024)
+        cache.evict()
+
+        fingerprint = json.dumps([self.orig_projection, self.table_config], sort_keys=True)
+        manifest = cache.find_run(table_name, fingerprint, singer.get_bookmark(state, table_name, 'spill_cache_run'))
+
+        if manifest:
+            with cache.hold(manifest['run_id']):
+                self.logger.info(f"Replaying {table_name} from spill cache run {manifest['run_id']}")
+                # The replay starts from the first page, so earlier partition progress no longer applies
+                stream_state.pop('partition_key_bookmarks', None)
+                stream_state.pop('finished_partition_keys', None)
+                for result in cache.read_pages(manifest):
+                    yield result
+
+                if not manifest['complete']:
+                    self.logger.info(f"Resuming {table_name} after the pages of spill cache run {manifest['run_id']}")
+                    checkpoint = manifest['checkpoint'] or {}
+                    if checkpoint.get('partition_key_bookmarks'):
+                        singer.write_bookmark(state, table_name, 'partition_key_bookmarks',
+                                              checkpoint['partition_key_bookmarks'])
+                    if checkpoint.get('finished_partition_keys'):
+                        singer.write_bookmark(state, table_name, 'finished_partition_keys',
+                                              checkpoint['finished_partition_keys'])
+                    last_evaluated_key = checkpoint.get('last_evaluated_key')
+                    results = self.full_table_get_results(
+                        full_table.resume_key(last_evaluated_key) if last_evaluated_key else None
+                    )
+                    for result in cache.write_pages(manifest, results, self.spill_cache_checkpoint):
+                        yield result
+
+        elif 'partition_key_bookmarks' in stream_state or 'finished_partition_keys' in stream_state:
+            for result in self.full_table_get_results():
+                yield result
+
+        else:
+            run_id = uuid4().hex
+            with cache.hold(run_id):
+                manifest = cache.new_run(run_id, table_name, fingerprint)
+                singer.write_bookmark(state, table_name, 'spill_cache_run', run_id)
+                for result in cache.write_pages(manifest, self.full_table_get_results(), self.spill_cache_checkpoint):
+                    yield result
+
+        stream_state.pop('spill_cache_run', None)
+
+    def spill_cache_checkpoint(self, result):
+        """Returns how to continue a full table sync after a result page has been emitted."""
+        if self.table_config.get('partition_key_values'):
+            return {
+                'partition_key_bookmarks': copy.deepcopy(
+                    singer.get_bookmark(self.tap_state, self.name, 'partition_key_bookmarks', {})),
+                'finished_partition_keys': list(
+                    singer.get_bookmark(self.tap_state, self.name, 'finished_partition_keys', [])),
+            }
+        if result.get('LastEvaluatedKey'):
+            return {'last_evaluated_key': full_table.bookmark_key(result['LastEvaluatedKey'])}
+        return None
+
+    def query_get_results(self, table_info, table_config):
+        """
+        Yields Query result pages for each configured partition key value,
+        querying the partitions concurrently. Progress is bookmarked per
+        partition value so an interrupted sync resumes where each left off.
+        """
+        table_name = self.name
+        state = self.tap_state
+
+        # Stores a dictionary of partition value : LastEvaluatedKey for
+        # partitions which have been started but not fully synced
+        partition_key_bookmarks = singer.get_bookmark(state, table_name, 'partition_key_bookmarks')
+        if not partition_key_bookmarks:
+            partition_key_bookmarks = dict()
+
+        finished_partition_keys = singer.get_bookmark(state, table_name, 'finished_partition_keys')
+        if not finished_partition_keys:
+            finished_partition_keys = list()
+
+        partition_params = {
+            partition_value: params
+            for partition_value, params in full_table.build_query_params(table_info, table_config).items()
+            if partition_value not in finished_partition_keys
+        }
+
+        start_keys = {
+            partition_value: full_table.resume_key(bookmark)
+            for partition_value, bookmark in partition_key_bookmarks.items()
+        }
+        results = full_table.query_partitions(table_name, self.orig_projection, partition_params,
+                                              start_keys, self.config,
+                                              table_config.get('query_concurrency', 4))
+        for partition_value, result in results:
+            yield result
+
+            # Only bookmark a page once all of its items have been emitted
+            if result.get('LastEvaluatedKey'):
+                partition_key_bookmarks[partition_value] = full_table.bookmark_key(result['LastEvaluatedKey'])
+                state = singer.write_bookmark(state, table_name, 'partition_key_bookmarks',
+                                              partition_key_bookmarks)
+            else:
+                partition_key_bookmarks.pop(partition_value, None)
+                finished_partition_keys.append(partition_value)
+                state = singer.write_bookmark(state, table_name, 'partition_key_bookmarks',
+                                              partition_key_bookmarks)
+                state = singer.write_bookmark(state, table_name, 'finished_partition_keys',
+                                              finished_partition_keys)
+
+        # Every partition is synced, so the next sync starts from scratch
+        state.get('bookmarks', {}).get(table_name, {}).pop('partition_key_bookmarks', None)
+        state.get('bookmarks', {}).get(table_name, {}).pop('finished_partition_keys', None)
+
     def log_based_get_records(self):
         table_name = self.name
 
@@ -93,16 +371,23 @@ class DynamoDBStream(Stream):
         found_shards = []
 
         deserializer = Deserializer()
+        table_config = self.table_config
+
+        projection = self.orig_projection
+        if projection is not None and projection != '':
+            projection = [x.strip().split('.') for x in projection.split(',')]
 
         for shard in log_based.get_shards(streams_client, stream_arn):
             found_shards.append(shard['ShardId'])
             # Only sync shards which we have not fully synced already
-            if shard['ShardId'] not in finished_shard_bookmarks:
-                records = self.process_shard(shard, seq_number_bookmarks, streams_client, stream_arn,
-                                             self.orig_projection, deserializer,
-                                             table_name, state)
-                for record in records:
-                    yield record
+            if shard['ShardId'] in finished_shard_bookmarks:
+                continue
+
+            records = self.process_shard(shard, seq_number_bookmarks, streams_client, stream_arn,
+                                         projection, deserializer,
+                                         table_name, state, table, table_config)
+            for record in records:
+                yield flatten_json(record, self.config.get('except_keys', []))
 
             # Now that we have fully synced the shard, move it from the
             # shard_seq_numbers to finished_shards.
@@ -113,35 +398,39 @@ class DynamoDBStream(Stream):
                 seq_number_bookmarks.pop(shard['ShardId'])
                 state = singer.write_bookmark(state, table_name, 'shard_seq_numbers', seq_number_bookmarks)
 
-        for shardId in finished_shard_bookmarks:
-            if shardId not in found_shards:
-                # Remove this shard because its no longer appearing when we query for get_shards
-                finished_shard_bookmarks.remove(shardId)
-                state = singer.write_bookmark(state, table_name, 'finished_shards', finished_shard_bookmarks)
+        # Remove shards which are no longer appearing when we query for get_shards
+        finished_shard_bookmarks = [shard_id for shard_id in finished_shard_bookmarks if shard_id in found_shards]
+        state = singer.write_bookmark(state, table_name, 'finished_shards', finished_shard_bookmarks)
 
     def process_shard(
-            self, shard, seq_number_bookmarks, streams_client, stream_arn, projection, deserializer, table_name, state
+            self, shard, seq_number_bookmarks, streams_client, stream_arn, projection, deserializer, table_name, state,
+            table_info=None, table_config=None
     ):
         seq_number = seq_number_bookmarks.get(shard['ShardId'])
 
         for record in log_based.get_shard_records(streams_client, stream_arn, shard, seq_number):
-            if record['eventName'] == 'REMOVE':
-                record_message = deserializer.deserialize_item(record['dynamodb']['Keys'])
-                deleted_at = record['dynamodb']['ApproximateCreationDateTime']
-                record_message["_sdc_deleted_at"] = singer.utils.strftime(deleted_at)
-            else:
-                record_message = deserializer.deserialize_item(record['dynamodb'].get('NewImage'))
-                if record_message is None:
-                    self.logger.fatal('Dynamo stream view type must be either "NEW_IMAGE" "NEW_AND_OLD_IMAGES"')
-                    raise RuntimeError('Dynamo stream view type must be either "NEW_IMAGE" "NEW_AND_OLD_IMAGES"')
-                if projection is not None and projection != '':
-                    try:
-                        record_message = deserializer.apply_projection(record_message, projection)
-                    except:
-                        self.logger.fatal("Projection failed to apply: %s", projection)
-                        raise RuntimeError('Projection failed to apply: {}'.format(projection))
-
-            yield record_message
+            # Skip changes outside the table_configs slice the initial scan extracted
+            if not table_config or full_table.key_in_slice(table_info, table_config, record['dynamodb']['Keys']):
+                yield self.process_shard_record(record, projection, deserializer)
 
             seq_number_bookmarks[shard['ShardId']] = record['dynamodb']['SequenceNumber']
             singer.write_bookmark(state, table_name, 'shard_seq_numbers', seq_number_bookmarks)
+
+    def process_shard_record(self, record, projection, deserializer):
+        if record['eventName'] == 'REMOVE':
+            record_message = deserializer.deserialize_item(record['dynamodb']['Keys'])
+            deleted_at = record['dynamodb']['ApproximateCreationDateTime']
+            record_message["_sdc_deleted_at"] = singer.utils.strftime(deleted_at)
+        else:
+            record_message = deserializer.deserialize_item(record['dynamodb'].get('NewImage'))
+            if record_message is None:
+                self.logger.fatal('Dynamo stream view type must be either "NEW_IMAGE" "NEW_AND_OLD_IMAGES"')
+                raise RuntimeError('Dynamo stream view type must be either "NEW_IMAGE" "NEW_AND_OLD_IMAGES"')
+            if projection is not None and projection != '':
+                try:
+                    record_message = deserializer.apply_projection(record_message, projection)
+                except:
+                    self.logger.fatal("Projection failed to apply: %s", projection)
+                    raise RuntimeError('Projection failed to apply: {}'.format(projection))
+
+        return record_message
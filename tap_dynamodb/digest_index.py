@@ -0,0 +1,90 @@
+"""
+A local SQLite index of item digests, used to detect changed items in tables without DynamoDB Streams.
+"""
+
+import hashlib
+import os
+import sqlite3
+
+import simplejson as json
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+MAX_QUERY_PARAMS = 500
+
+
+class DigestIndex:
+    """
+    Stores a compact digest of every item keyed by its primary key. Each sync
+    is a new run which records the digests of every item it sees. Items are
+    compared against the digests of the baseline run, which is the run named
+    in the incoming state, and any baseline key not seen by the end of the run
+    has been deleted. Only the baseline and the latest run are kept, so a run
+    whose final state never reached the target is compared against the same
+    baseline again and re-emits its changes.
+    """
+
+    def __init__(self, directory, table_name, baseline_run_id=None):
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, f'{table_name}.sqlite'))
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            'run_id INTEGER NOT NULL, key TEXT NOT NULL, digest BLOB NOT NULL, PRIMARY KEY (run_id, key))'
+        )
+        self.connection.commit()
+
+        self.baseline_run_id = baseline_run_id
+        self.run_id = self.connection.execute('SELECT COALESCE(MAX(run_id), 0) + 1 FROM digests').fetchone()[0]
+
+    @staticmethod
+    def item_key(record, key_properties):
+        return json.dumps([record.get(key) for key in key_properties], use_decimal=True, default=str)
+
+    @staticmethod
+    def item_digest(record):
+        serialized = json.dumps(record, sort_keys=True, use_decimal=True, default=str)
+        return hashlib.blake2b(serialized.encode(), digest_size=16).digest()
+
+    def filter_changed(self, records, key_properties):
+        """
+        Returns the records which are new or changed since the baseline run,
+        marking every given record as seen in this run.
+        """
+        entries = [(self.item_key(record, key_properties), self.item_digest(record)) for record in records]
+
+        previous = {}
+        if self.baseline_run_id is not None:
+            for i in range(0, len(entries), MAX_QUERY_PARAMS):
+                keys = [key for key, _ in entries[i:i + MAX_QUERY_PARAMS]]
+                placeholders = ','.join('?' * len(keys))
+                previous.update(self.connection.execute(
+                    f'SELECT key, digest FROM digests WHERE run_id = ? AND key IN ({placeholders})',
+                    [self.baseline_run_id, *keys]
+                ))
+
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO digests (run_id, key, digest) VALUES (?, ?, ?)',
+            [(self.run_id, key, digest) for key, digest in entries]
+        )
+
+        return [record for record, (key, digest) in zip(records, entries) if previous.get(key) != digest]
+
+    def deleted(self, key_properties):
+        """Yields the primary key values of baseline items not seen in this run."""
+        if self.baseline_run_id is None:
+            return
+        cursor = self.connection.execute(
+            'SELECT key FROM digests AS baseline WHERE run_id = ? AND NOT EXISTS '
+            '(SELECT 1 FROM digests WHERE run_id = ? AND key = baseline.key)',
+            (self.baseline_run_id, self.run_id)
+        )
+        for (key,) in cursor:
+            yield dict(zip(key_properties, json.loads(key, use_decimal=True)))
+
+    def commit(self):
+        """Commits this run, removing every run other than it and its baseline."""
+        baseline_run_id = self.run_id if self.baseline_run_id is None else self.baseline_run_id
+        self.connection.execute('DELETE FROM digests WHERE run_id NOT IN (?, ?)', (baseline_run_id, self.run_id))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
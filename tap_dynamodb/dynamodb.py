@@ -3,6 +3,8 @@ DynamoDB access utilities. Taken heavily from
 https://github.com/singer-io/tap-dynamodb/blob/master/tap_dynamodb/dynamodb.py
 """
 
+import threading
+
 import backoff
 import boto3
 import singer
@@ -18,6 +20,11 @@ from botocore.session import Session
 
 LOGGER = singer.get_logger()
 
+# boto3 sessions are not thread-safe, so clients are created one at a time
+# from the default session and shared, which is safe, by concurrent streams
+_clients = {}
+_clients_lock = threading.Lock()
+
 
 def retry_pattern():
     return backoff.on_exception(backoff.expo,
@@ -71,25 +78,30 @@ def setup_aws_client(config):
         )
 
         LOGGER.info(f"Attempting to assume_role on RoleArn: {role_arn}")
-        boto3.setup_default_session(botocore_session=refreshable_session)
+        with _clients_lock:
+            boto3.setup_default_session(botocore_session=refreshable_session)
+            _clients.clear()
     else:
         session = Session()
 
         LOGGER.info("Using default AWS session")
-        boto3.setup_default_session(botocore_session=session)
+        with _clients_lock:
+            boto3.setup_default_session(botocore_session=session)
+            _clients.clear()
+
+
+def _shared_client(service_name, config):
+    endpoint_url = 'http://localhost:8000' if config.get('use_local_dynamo') else None
+    key = (service_name, config['region_name'], endpoint_url)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(service_name, endpoint_url=endpoint_url, region_name=config['region_name'])
+        return _clients[key]
 
 
 def get_client(config):
-    if config.get('use_local_dynamo'):
-        return boto3.client('dynamodb',
-                            endpoint_url='http://localhost:8000',
-                            region_name=config['region_name'])
-    return boto3.client('dynamodb', config['region_name'])
+    return _shared_client('dynamodb', config)
 
 
 def get_stream_client(config):
-    if config.get('use_local_dynamo'):
-        return boto3.client('dynamodbstreams',
-                            endpoint_url='http://localhost:8000',
-                            region_name=config['region_name'])
-    return boto3.client('dynamodbstreams', region_name=config['region_name'])
+    return _shared_client('dynamodbstreams', config)
@@ -0,0 +1,166 @@
+"""
+Runs several table streams concurrently under global worker, memory and read capacity limits.
+"""
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# DynamoDB returns at most 1MB of data per Scan or Query page, which takes
+# several times that once deserialized into Python objects
+ESTIMATED_PAGE_MEMORY_MB = 8
+
+# Held while writing Singer messages so lines from concurrent streams never interleave
+OUTPUT_LOCK = threading.RLock()
+
+# Held while reading or changing the bookmarks last emitted for each stream
+STATE_LOCK = threading.RLock()
+
+
+class Budget:
+    """A counting budget which blocks acquirers until enough of it is free."""
+
+    def __init__(self, total):
+        self.total = total
+        self.available = total
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        """
+        Blocks until amount is available and returns the amount actually
+        reserved. Requests larger than the whole budget reserve all of it.
+        """
+        amount = min(amount, self.total)
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= amount)
+            self.available -= amount
+        return amount
+
+    def release(self, amount):
+        with self.condition:
+            self.available += amount
+            self.condition.notify_all()
+
+
+class ReadCapacityBudget:
+    """
+    A token bucket of read capacity units shared by all streams. Requests
+    wait while the bucket is empty and are charged the capacity DynamoDB
+    reports as consumed, so the long run rate stays at units_per_second.
+    """
+
+    def __init__(self):
+        self.units_per_second = None
+        self.tokens = 0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.units_per_second is not None
+
+    def set_limit(self, units_per_second):
+        with self.lock:
+            self.units_per_second = units_per_second
+            self.tokens = units_per_second or 0
+            self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.units_per_second,
+                          self.tokens + (now - self.updated_at) * self.units_per_second)
+        self.updated_at = now
+
+    def acquire(self):
+        if not self.limited:
+            return
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens > 0:
+                    return
+                wait = -self.tokens / self.units_per_second
+            time.sleep(wait)
+
+    def consume(self, units):
+        if not self.limited:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens -= units
+
+
+READ_CAPACITY = ReadCapacityBudget()
+
+
+def order_streams(streams, priority, table_configs, table_sizes):
+    """
+    Returns the streams in the order they should be started.
+
+    priority is one of `discovery` (the order the tables were discovered),
+    `largest_first` (by table size in bytes), or `configured` (by the
+    `priority` in each table's config, highest first).
+    """
+    if priority == 'largest_first':
+        return sorted(streams, key=lambda stream: -table_sizes.get(stream.name, 0))
+    if priority == 'configured':
+        return sorted(streams, key=lambda stream: -table_configs.get(stream.name, {}).get('priority', 0))
+    return list(streams)
+
+
+def estimate_memory_mb(table_config, batch_buffer_bytes=0):
+    """
+    Estimates the memory held by a stream's in-flight pages, plus the
+    batch_buffer_bytes it may hold while filling a batch file.
+    """
+    memory_mb = math.ceil(batch_buffer_bytes / (1024 * 1024))
+    if table_config.get('partition_key_values'):
+        # Each worker holds a page and the result queue holds two per worker
+        return memory_mb + ESTIMATED_PAGE_MEMORY_MB * 3 * table_config.get('query_concurrency', 4)
+    return memory_mb + ESTIMATED_PAGE_MEMORY_MB
+
+
+def run(jobs, max_workers, max_memory_mb=None):
+    """
+    Runs (name, memory_mb, fn) jobs in the given order, starting each as soon
+    as a worker and its memory estimate are free. No further jobs are started
+    once one fails, and the first failure is raised after running jobs finish.
+    """
+    workers = Budget(max_workers)
+    memory = Budget(max_memory_mb) if max_memory_mb else None
+    failed = threading.Event()
+
+    def run_job(name, memory_mb, fn):
+        try:
+            fn()
+        except Exception:
+            LOGGER.error(f'Sync of {name} failed, no further streams will be started')
+            failed.set()
+            raise
+        finally:
+            if memory:
+                memory.release(memory_mb)
+            workers.release(1)
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for name, memory_mb, fn in jobs:
+            workers.acquire(1)
+            if memory:
+                memory_mb = memory.acquire(memory_mb)
+            if failed.is_set():
+                if memory:
+                    memory.release(memory_mb)
+                workers.release(1)
+                break
+
+            LOGGER.info(f'Starting sync of {name}')
+            futures.append(executor.submit(run_job, name, memory_mb, fn))
+
+    for future in futures:
+        future.result()
@@ -0,0 +1,209 @@
+"""
+A local cache of raw table pages, used to replay a failed sync from disk instead of rescanning the table.
+"""
+
+import base64
+import contextlib
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+MANIFEST = 'manifest.json'
+
+# Runs being replayed or written by this process, which eviction must never remove
+_active_runs = set()
+_lock = threading.Lock()
+
+
+def _encode(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(obj).decode('utf-8')}
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _decode(obj):
+    if '__bytes__' in obj and len(obj) == 1:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+class SpillCache:
+    """
+    Stores each run as a directory of gzipped JSON lines segments, one page
+    per line, plus a manifest listing the closed segments. The manifest also
+    holds the checkpoint to continue the sync from after the last page of the
+    closed segments, so an interrupted run can be replayed and then resumed.
+    Runs older than retention_hours are removed, and the oldest runs are
+    removed while the cache is larger than max_bytes.
+    """
+
+    def __init__(self, directory, retention_hours, max_bytes):
+        self.directory = directory
+        self.retention_seconds = retention_hours * 3600
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _run_dir(self, run_id):
+        return os.path.join(self.directory, run_id)
+
+    def _read_manifest(self, run_id):
+        try:
+            with open(os.path.join(self._run_dir(run_id), MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self._run_dir(manifest['run_id']), MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _manifests(self):
+        for run_id in os.listdir(self.directory):
+            manifest = self._read_manifest(run_id)
+            if manifest is not None:
+                yield manifest
+
+    def _remove(self, run_id):
+        LOGGER.info(f'Evicting spill cache run {run_id}')
+        shutil.rmtree(self._run_dir(run_id), ignore_errors=True)
+
+    def evict(self):
+        """Removes expired runs, then the oldest runs until the cache fits in max_bytes."""
+        with _lock:
+            now = time.time()
+            manifests = sorted(
+                (manifest for manifest in self._manifests() if manifest['run_id'] not in _active_runs),
+                key=lambda manifest: manifest['created_at']
+            )
+            kept = []
+            for manifest in manifests:
+                if now - manifest['created_at'] > self.retention_seconds:
+                    self._remove(manifest['run_id'])
+                else:
+                    kept.append(manifest)
+
+            total = sum(manifest['bytes'] for manifest in self._manifests())
+            for manifest in kept:
+                if total <= self.max_bytes:
+                    break
+                self._remove(manifest['run_id'])
+                total -= manifest['bytes']
+
+    @contextlib.contextmanager
+    def hold(self, run_id):
+        """Protects a run from eviction while it is replayed or written."""
+        with _lock:
+            _active_runs.add(run_id)
+        try:
+            yield
+        finally:
+            with _lock:
+                _active_runs.discard(run_id)
+
+    def find_run(self, table_name, fingerprint, run_id):
+        """
+        Returns the manifest of the run named by a sync's state, or None if
+        there is no such run for the same table and table config.
+        """
+        if run_id is None:
+            return None
+        manifest = self._read_manifest(run_id)
+        if manifest is None or manifest['table_name'] != table_name or manifest['fingerprint'] != fingerprint:
+            return None
+        return manifest
+
+    def new_run(self, run_id, table_name, fingerprint):
+        """Creates an empty run and returns its manifest."""
+        manifest = {
+            'run_id': run_id,
+            'table_name': table_name,
+            'fingerprint': fingerprint,
+            'created_at': time.time(),
+            'complete': False,
+            'checkpoint': None,
+            'bytes': 0,
+            'segments': [],
+        }
+        os.makedirs(self._run_dir(run_id))
+        self._write_manifest(manifest)
+        return manifest
+
+    def read_pages(self, manifest):
+        for segment in manifest['segments']:
+            with gzip.open(os.path.join(self._run_dir(manifest['run_id']), segment), 'rt') as f:
+                for line in f:
+                    yield json.loads(line, object_hook=_decode)
+
+    def write_pages(self, manifest, pages, checkpoint):
+        """
+        Yields pages while spilling them to the run of manifest. A page is
+        written once the next page has been requested, when checkpoint(page)
+        returns how to continue the sync after it. Segments are recorded in the
+        manifest as they are closed: when full, when pages is exhausted, which
+        marks the run complete, or when the consumer stops early. Spilling
+        stops, and the run is removed, if it outgrows max_bytes.
+        """
+        run_id = manifest['run_id']
+        segment, segment_name, segment_bytes, segment_checkpoint = None, None, 0, None
+        spilling = True
+
+        def close_segment():
+            nonlocal segment
+            segment.close()
+            segment = None
+            manifest['segments'].append(segment_name)
+            manifest['bytes'] += os.path.getsize(os.path.join(self._run_dir(run_id), segment_name))
+            manifest['checkpoint'] = segment_checkpoint
+            self._write_manifest(manifest)
+
+        def spill(page):
+            nonlocal segment, segment_name, segment_bytes, segment_checkpoint, spilling
+            if segment is None:
+                segment_name = f"segment-{len(manifest['segments']) + 1:05d}.jsonl.gz"
+                segment = gzip.open(os.path.join(self._run_dir(run_id), segment_name), 'wt')
+                segment_bytes = 0
+
+            line = json.dumps({'Items': page.get('Items', [])}, default=_encode) + '\n'
+            segment.write(line)
+            segment_bytes += len(line)
+            segment_checkpoint = checkpoint(page)
+
+            if manifest['bytes'] + segment_bytes > self.max_bytes:
+                LOGGER.warning(f"Spill cache run {run_id} for {manifest['table_name']} exceeds the cache size, "
+                               f"no longer spilling it to disk")
+                segment.close()
+                segment = None
+                self._remove(run_id)
+                spilling = False
+            elif segment_bytes >= SEGMENT_MAX_BYTES:
+                close_segment()
+
+        pending = None
+        try:
+            for page in pages:
+                if pending is not None and spilling:
+                    spill(pending)
+                pending = page
+                yield page
+
+            if pending is not None and spilling:
+                spill(pending)
+            if spilling:
+                if segment is not None:
+                    close_segment()
+                manifest['complete'] = True
+                self._write_manifest(manifest)
+        finally:
+            # Keep the pages written so far if the sync stopped early
+            if segment is not None:
+                close_segment()
@@ -2,16 +2,28 @@
 Taken heavily from https://github.com/singer-io/tap-dynamodb/blob/master/tap_dynamodb/sync_strategies/full_table.py
 """
 
+import base64
+import queue
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 
 import botocore.exceptions
 import singer
 from tap_dynamodb import dynamodb
+from tap_dynamodb.scheduler import READ_CAPACITY
 
 LOGGER = singer.get_logger()
 
+PARTITION_KEY_NAME = '#tap_pk'
+PARTITION_KEY_VALUE = ':tap_pk'
+SORT_KEY_NAME = '#tap_sk'
+SORT_KEY_START = ':tap_sk_start'
+SORT_KEY_END = ':tap_sk_end'
 
-def scan_table(table_name, projection, last_evaluated_key, config, schema_inf=False):
+
+def scan_table(table_name, projection, last_evaluated_key, config, schema_inf=False, filter_params=None):
     scan_params = {
         'TableName': table_name,
         'Limit': config['num_inference_records'] if schema_inf else 1000
@@ -21,6 +33,8 @@ def scan_table(table_name, projection, last_evaluated_key, config, schema_inf=Fa
         scan_params['ProjectionExpression'] = projection
     if last_evaluated_key is not None:
         scan_params['ExclusiveStartKey'] = last_evaluated_key
+    if filter_params:
+        scan_params.update(filter_params)
 
     client = dynamodb.get_client(config)
     has_more = True
@@ -40,20 +54,294 @@ def scan_table(table_name, projection, last_evaluated_key, config, schema_inf=Fa
         has_more = result.get('LastEvaluatedKey', False)
 
 
+def query_table(client, table_name, projection, last_evaluated_key, query_params):
+    """
+    Yields result pages of a Query against a single partition key. The key
+    condition and any filter are expected in query_params, as built by
+    build_query_params.
+    """
+    params = {
+        'TableName': table_name,
+        'Limit': 1000,
+        **query_params
+    }
+
+    if projection is not None and projection != '':
+        params['ProjectionExpression'] = projection
+    if last_evaluated_key is not None:
+        params['ExclusiveStartKey'] = last_evaluated_key
+
+    has_more = True
+
+    while has_more:
+        LOGGER.info(f'Querying table {table_name} with params:')
+        for key, value in params.items():
+            LOGGER.info(f'\t{key} = {value}')
+
+        result = request_r(client.query, params)
+
+        yield result
+
+        if result.get('LastEvaluatedKey'):
+            params['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+        has_more = result.get('LastEvaluatedKey', False)
+
+
+def query_partitions(table_name, projection, partition_params, start_keys, config, max_workers):
+    """
+    Queries several partition keys concurrently and yields
+    (partition_value, result) tuples as pages arrive. A page without a
+    LastEvaluatedKey is the final page of its partition.
+
+    partition_params maps each partition value to its query params and
+    start_keys maps partition values to the ExclusiveStartKey to resume from.
+    """
+    # boto3 clients are thread safe once created, but creating them is not
+    client = dynamodb.get_client(config)
+    pages = queue.Queue(maxsize=max_workers * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker(partition_value):
+        if stop.is_set():
+            return
+        try:
+            for result in query_table(client, table_name, projection,
+                                      start_keys.get(partition_value),
+                                      partition_params[partition_value]):
+                # Stop before requesting another page once the consumer is gone
+                if not put((partition_value, result)) or stop.is_set():
+                    return
+        except Exception as e:
+            put((partition_value, e))
+        else:
+            put((partition_value, done))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = []
+    try:
+        for partition_value in partition_params:
+            futures.append(executor.submit(worker, partition_value))
+
+        remaining = len(partition_params)
+        while remaining:
+            partition_value, result = pages.get()
+            if result is done:
+                remaining -= 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield partition_value, result
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def build_filter_params(table_config):
+    """
+    Returns the FilterExpression and expression attribute params configured
+    for a table, or an empty dict if none are configured.
+    """
+    params = {}
+    if table_config.get('filter_expression'):
+        params['FilterExpression'] = table_config['filter_expression']
+    if table_config.get('expression_attribute_names'):
+        params['ExpressionAttributeNames'] = dict(table_config['expression_attribute_names'])
+    if table_config.get('expression_attribute_values'):
+        params['ExpressionAttributeValues'] = dict(table_config['expression_attribute_values'])
+    return params
+
+
+def build_scan_params(table_info, table_config):
+    """
+    Returns the filter params for a Scan. A sort key range without partition
+    keys cannot be queried, so it is applied as part of the filter instead.
+    """
+    params = build_filter_params(table_config)
+    sort_condition = _sort_key_condition(table_info, table_config, params)
+    if sort_condition:
+        LOGGER.info(f"No partition_key_values configured for {table_info['TableName']}, "
+                    f"applying sort_key_range as a scan filter")
+        if params.get('FilterExpression'):
+            params['FilterExpression'] = f"({params['FilterExpression']}) AND {sort_condition}"
+        else:
+            params['FilterExpression'] = sort_condition
+    return params
+
+
+def build_query_params(table_info, table_config):
+    """
+    Returns a dict of partition value to the Query params (key condition
+    plus any configured filter) for every configured partition key value.
+    """
+    partition_key = _key_attribute(table_info, 'HASH')
+    partition_type = _attribute_type(table_info, partition_key)
+
+    partition_params = {}
+    for partition_value in table_config.get('partition_key_values', []):
+        params = build_filter_params(table_config)
+        params.setdefault('ExpressionAttributeNames', {})[PARTITION_KEY_NAME] = partition_key
+        params.setdefault('ExpressionAttributeValues', {})[PARTITION_KEY_VALUE] = \
+            _typed_value(partition_type, partition_value)
+
+        key_condition = f'{PARTITION_KEY_NAME} = {PARTITION_KEY_VALUE}'
+        sort_condition = _sort_key_condition(table_info, table_config, params)
+        if sort_condition:
+            key_condition = f'{key_condition} AND {sort_condition}'
+        params['KeyConditionExpression'] = key_condition
+
+        partition_params[str(partition_value)] = params
+
+    return partition_params
+
+
+def key_in_slice(table_info, table_config, keys):
+    """
+    Returns whether an item's typed keys fall within the configured
+    partition_key_values and sort_key_range, mirroring the key condition
+    used to Query them.
+    """
+    partition_key = _key_attribute(table_info, 'HASH')
+    partition_type = _attribute_type(table_info, partition_key)
+    if table_config.get('partition_key_values'):
+        partition_values = [_typed_value(partition_type, value) for value in table_config['partition_key_values']]
+        if keys.get(partition_key) not in partition_values:
+            return False
+
+    sort_key_range = table_config.get('sort_key_range') or {}
+    start, end = sort_key_range.get('start'), sort_key_range.get('end')
+    if start is None and end is None:
+        return True
+
+    sort_key = _key_attribute(table_info, 'RANGE')
+    sort_type = _attribute_type(table_info, sort_key)
+    sort_value = _comparable_value(sort_type, keys[sort_key])
+    if start is not None and sort_value < _comparable_value(sort_type, _typed_value(sort_type, start)):
+        return False
+    if end is not None and sort_value > _comparable_value(sort_type, _typed_value(sort_type, end)):
+        return False
+    return True
+
+
+def _comparable_value(attribute_type, typed_value):
+    """Returns a key value which compares the way DynamoDB orders sort keys."""
+    value = typed_value[attribute_type]
+    if attribute_type == 'N':
+        return Decimal(value)
+    return value
+
+
+def _sort_key_condition(table_info, table_config, params):
+    """
+    Builds the sort key range condition, adding its placeholders to params.
+    Returns None if no range is configured.
+    """
+    sort_key_range = table_config.get('sort_key_range') or {}
+    start, end = sort_key_range.get('start'), sort_key_range.get('end')
+    if start is None and end is None:
+        return None
+
+    sort_key = _key_attribute(table_info, 'RANGE')
+    if sort_key is None:
+        raise ValueError(f"sort_key_range configured for {table_info['TableName']}, "
+                         f"but the table has no sort key")
+    sort_type = _attribute_type(table_info, sort_key)
+
+    params.setdefault('ExpressionAttributeNames', {})[SORT_KEY_NAME] = sort_key
+    values = params.setdefault('ExpressionAttributeValues', {})
+    if start is not None:
+        values[SORT_KEY_START] = _typed_value(sort_type, start)
+    if end is not None:
+        values[SORT_KEY_END] = _typed_value(sort_type, end)
+
+    if start is not None and end is not None:
+        return f'{SORT_KEY_NAME} BETWEEN {SORT_KEY_START} AND {SORT_KEY_END}'
+    if start is not None:
+        return f'{SORT_KEY_NAME} >= {SORT_KEY_START}'
+    return f'{SORT_KEY_NAME} <= {SORT_KEY_END}'
+
+
+def _key_attribute(table_info, key_type):
+    for key_schema in table_info.get('KeySchema', []):
+        if key_schema['KeyType'] == key_type:
+            return key_schema['AttributeName']
+    return None
+
+
+def _attribute_type(table_info, attribute_name):
+    for definition in table_info.get('AttributeDefinitions', []):
+        if definition['AttributeName'] == attribute_name:
+            return definition['AttributeType']
+    return 'S'
+
+
+def _typed_value(attribute_type, value):
+    """
+    Key values are configured as strings; binary keys are expected to be
+    base64 encoded, matching how they are emitted by the Deserializer.
+    """
+    if attribute_type == 'B':
+        return {'B': base64.b64decode(value)}
+    return {attribute_type: str(value)}
+
+
+def bookmark_key(last_evaluated_key):
+    """
+    Returns a LastEvaluatedKey which can be stored in state. Binary key
+    values are base64 encoded, matching how key values are configured.
+    """
+    return {
+        attribute: {key_type: base64.b64encode(value).decode('utf-8') if key_type == 'B' else value}
+        for attribute, typed_value in last_evaluated_key.items()
+        for key_type, value in typed_value.items()
+    }
+
+
+def resume_key(bookmark):
+    """Returns the ExclusiveStartKey for a key stored by bookmark_key."""
+    return {
+        attribute: {key_type: base64.b64decode(value) if key_type == 'B' else value}
+        for attribute, typed_value in bookmark.items()
+        for key_type, value in typed_value.items()
+    }
+
+
 def scan_r(client, scan_params):
+    return request_r(client.scan, scan_params)
+
+
+def request_r(method, params):
+    if READ_CAPACITY.limited:
+        params['ReturnConsumedCapacity'] = 'TOTAL'
+    READ_CAPACITY.acquire()
     try:
-        result = client.scan(**scan_params)
+        result = method(**params)
+        READ_CAPACITY.consume(result.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
     except botocore.exceptions.ClientError as e:
+        if 'reserved keyword' not in str(e):
+            raise
         kw = str(e).split(" ")[-1]
         LOGGER.info(f"Modifying projection expression: error with reserved keyword: {kw}")
         attr_nm = f"#{kw[0:2]}"
-        scan_params['ProjectionExpression'] = re.sub(f"(?<=,){kw}(?=$|,)|(?<=^){kw}(?=$|,)",
-                                                     f"{attr_nm}",
-                                                     scan_params['ProjectionExpression'])
-        if scan_params.get('ExpressionAttributeNames'):
-            scan_params['ExpressionAttributeNames'][attr_nm] = kw
+        params['ProjectionExpression'] = re.sub(f"(?<=,){kw}(?=$|,)|(?<=^){kw}(?=$|,)",
+                                                f"{attr_nm}",
+                                                params['ProjectionExpression'])
+        if params.get('ExpressionAttributeNames'):
+            params['ExpressionAttributeNames'][attr_nm] = kw
         else:
-            scan_params['ExpressionAttributeNames'] = {attr_nm: kw}
-        result = scan_r(client, scan_params)
+            params['ExpressionAttributeNames'] = {attr_nm: kw}
+        result = request_r(method, params)
 
-    return result
\ No newline at end of file
+    return result
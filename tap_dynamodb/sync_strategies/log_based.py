@@ -102,13 +102,19 @@ def has_stream_aged_out(state, table_name):
 def get_initial_bookmarks(config, state, table_name):
     """
     Returns the state including all bookmarks necessary for the initial
-    full table sync
+    full table sync. Must be called before the full table scan starts: the
+    shards closed at that point only hold changes already reflected in the
+    scan, so they are marked as finished. Shards still open are replayed
+    once they close, which may re-emit some records seen by the scan.
     """
     client = dynamodb.get_client(config)
     streams_client = dynamodb.get_stream_client(config)
 
     table = client.describe_table(TableName=table_name)['Table']
-    stream_arn = table['LatestStreamArn']
+    try:
+        stream_arn = table['LatestStreamArn']
+    except KeyError:
+        raise RuntimeError("Streams are not enabled for this table. Please use FULL_TABLE replication")
 
     finished_shard_bookmarks = [shard['ShardId'] for shard in get_shards(streams_client, stream_arn)]
     state = singer.write_bookmark(state, table_name, 'finished_shards', finished_shard_bookmarks)
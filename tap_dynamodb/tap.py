@@ -1,13 +1,15 @@
 """DynamoDB tap class."""
 
+import copy
 from typing import List
 
 from botocore.exceptions import ClientError
 from singer_sdk import Tap, Stream
 from singer_sdk import typing as th
+from singer_sdk.helpers.capabilities import PluginCapabilities
 
 from tap_dynamodb.streams import DynamicStream
-from tap_dynamodb import dynamodb
+from tap_dynamodb import batch, dynamodb, scheduler
 from tap_dynamodb.schema import flatten_json, infer_schema, merge_schemas
 from tap_dynamodb.sync_strategies.full_table import scan_table
 from tap_dynamodb.deserialize import Deserializer
@@ -33,6 +35,10 @@ class TapDynamoDB(Tap):
     }
 
     name = "tap-dynamodb"
+    capabilities = [*Tap.capabilities, PluginCapabilities.BATCH]
+
+    # Set by sync_all, see emitted_bookmarks
+    _emitted_bookmarks = None
 
     config_jsonschema = _merge_dicts(jsonschema_additional_dict, th.PropertiesList(
         th.Property("region_name", th.StringType, required=True),
@@ -42,6 +48,41 @@ class TapDynamoDB(Tap):
         th.Property("use_local_dynamo", th.BooleanType, default=False, required=False),
         th.Property('num_inference_records', th.NumberType, default=50, required=False),
         th.Property('tables_to_discover', th.ArrayType(th.StringType), default=[], required=False),
+        th.Property('table_configs', th.ObjectType(additional_properties=th.ObjectType(
+            th.Property('filter_expression', th.StringType, required=False),
+            th.Property('expression_attribute_names', th.ObjectType(additional_properties=th.StringType),
+                        required=False),
+            th.Property('expression_attribute_values', th.ObjectType(), required=False),
+            th.Property('partition_key_values', th.ArrayType(th.StringType), required=False),
+            th.Property('sort_key_range', th.ObjectType(
+                th.Property('start', th.StringType, required=False),
+                th.Property('end', th.StringType, required=False),
+            ), required=False),
+            th.Property('query_concurrency', th.IntegerType, default=4, required=False),
+            th.Property('change_detection', th.BooleanType, default=False, required=False),
+            th.Property('priority', th.IntegerType, default=0, required=False),
+        )), default={}, required=False),
+        th.Property('digest_index_dir', th.StringType, default='.tap_dynamodb', required=False),
+        th.Property('spill_cache_dir', th.StringType, required=False),
+        th.Property('spill_cache_retention_hours', th.IntegerType, default=24, required=False),
+        th.Property('spill_cache_max_mb', th.IntegerType, default=10240, required=False),
+        th.Property('max_concurrent_streams', th.IntegerType, default=1, required=False),
+        th.Property('max_memory_mb', th.IntegerType, required=False),
+        th.Property('max_read_capacity_units', th.NumberType, required=False),
+        th.Property('stream_priority', th.StringType, default='discovery', required=False,
+                    allowed_values=['discovery', 'largest_first', 'configured']),
+        th.Property('batch_config', th.ObjectType(
+            th.Property('encoding', th.ObjectType(
+                th.Property('format', th.StringType, required=True),
+                th.Property('compression', th.StringType, required=False),
+            ), required=True),
+            th.Property('storage', th.ObjectType(
+                th.Property('root', th.StringType, required=True),
+                th.Property('prefix', th.StringType, required=False),
+            ), required=True),
+        ), required=False),
+        th.Property('batch_max_records', th.IntegerType, required=False),
+        th.Property('batch_max_bytes', th.IntegerType, required=False),
     ).to_dict())
 
     def discover_streams(self) -> List[Stream]:
@@ -65,6 +106,76 @@ class TapDynamoDB(Tap):
 
         return streams
 
+    @property
+    def emitted_bookmarks(self) -> dict:
+        """
+        The bookmarks of each stream as last written in a STATE message, which
+        are the only ones a stream's STATE messages include for other streams.
+        Must be used while holding `scheduler.STATE_LOCK`.
+        """
+        if self._emitted_bookmarks is None:
+            self._emitted_bookmarks = copy.deepcopy(self.state.get('bookmarks', {}))
+        return self._emitted_bookmarks
+
+    def sync_all(self) -> None:
+        """Sync all streams, running up to `max_concurrent_streams` table streams at once."""
+        max_concurrent_streams = self.config.get('max_concurrent_streams', 1)
+        scheduler.READ_CAPACITY.set_limit(self.config.get('max_read_capacity_units'))
+        self._reset_state_progress_markers()
+        with scheduler.STATE_LOCK:
+            self._emitted_bookmarks = copy.deepcopy(self.state.get('bookmarks', {}))
+        if max_concurrent_streams <= 1:
+            super().sync_all()
+            return
+
+        self._set_compatible_replication_methods()
+
+        streams = []
+        for stream in self.streams.values():
+            if not stream.selected:
+                self.logger.info(f"Skipping deselected stream '{stream.name}'.")
+                continue
+            # Create every stream's state entry up front, so concurrent syncs
+            # never add keys to the shared bookmarks dict
+            self.state.setdefault('bookmarks', {}).setdefault(stream.name, {})
+            streams.append(stream)
+
+        table_configs = self.config.get('table_configs', {})
+        table_sizes = {}
+        if self.config.get('stream_priority') == 'largest_first':
+            client = dynamodb.get_client(self.config)
+            for stream in streams:
+                table_info = client.describe_table(TableName=stream.name)['Table']
+                table_sizes[stream.name] = table_info.get('TableSizeBytes', 0)
+
+        jobs = [
+            (stream.name,
+             scheduler.estimate_memory_mb(table_configs.get(stream.name, {}), self._batch_buffer_bytes(stream)),
+             self._sync_stream_job(stream))
+            for stream in scheduler.order_streams(streams, self.config.get('stream_priority'),
+                                                  table_configs, table_sizes)
+        ]
+        scheduler.run(jobs, max_concurrent_streams, self.config.get('max_memory_mb'))
+
+        for stream in self.streams.values():
+            stream.log_sync_costs()
+
+    @staticmethod
+    def _batch_buffer_bytes(stream):
+        """Returns the size of the batch file a stream may buffer, or 0 without `batch_config`."""
+        batch_config = stream.get_batch_config(stream.config)
+        if not batch_config:
+            return 0
+        return batch.batch_limits(stream.config, batch_config.encoding)[1]
+
+    @staticmethod
+    def _sync_stream_job(stream):
+        def job():
+            stream.sync()
+            stream.finalize_state_progress_markers()
+            stream._write_state_message()
+        return job
+
     def discover_table_schema(self, client, table_name):
         try:
             table_info = client.describe_table(TableName=table_name).get('Table', {})
@@ -96,6 +207,13 @@ class TapDynamoDB(Tap):
                     break
             break
 
+        # Deletes replayed from DynamoDB Streams or found by change detection set _sdc_deleted_at
+        table_config = self.config.get('table_configs', {}).get(table_name, {})
+        if table_config.get('change_detection') or table_info.get('LatestStreamArn'):
+            schema = merge_schemas(schema, th.PropertiesList(
+                th.Property('_sdc_deleted_at', th.DateTimeType, required=False),
+            ).to_dict())
+
         return DynamicStream(
             tap=self,
             name=table_name,
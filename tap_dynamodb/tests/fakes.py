@@ -0,0 +1,87 @@
+"""In-memory stand-ins for the DynamoDB clients used by the tap."""
+
+from unittest import mock
+
+from tap_dynamodb.streams import DynamicStream
+from tap_dynamodb.tap import TapDynamoDB
+
+
+class FakeClient:
+    """
+    A DynamoDB client serving the items of a single table. Items are typed
+    DynamoDB JSON; pages hold page_size items and end with the key of their
+    last item as LastEvaluatedKey, like the real API.
+    """
+
+    def __init__(self, table_info, items, page_size=2):
+        self.table_info = table_info
+        self.items = items
+        self.page_size = page_size
+        self.requests = []
+
+    def _key(self, item):
+        return {key['AttributeName']: item[key['AttributeName']] for key in self.table_info['KeySchema']}
+
+    def _page(self, items, params):
+        start = 0
+        if params.get('ExclusiveStartKey'):
+            keys = [self._key(item) for item in items]
+            start = keys.index(params['ExclusiveStartKey']) + 1
+
+        page = items[start:start + self.page_size]
+        result = {'Items': page}
+        if start + self.page_size < len(items):
+            result['LastEvaluatedKey'] = self._key(page[-1])
+        return result
+
+    def list_tables(self):
+        return {'TableNames': [self.table_info['TableName']]}
+
+    def describe_table(self, TableName):
+        return {'Table': self.table_info}
+
+    def scan(self, **params):
+        self.requests.append(('scan', params))
+        return self._page(self.items, params)
+
+    def query(self, **params):
+        self.requests.append(('query', params))
+        partition_key = params['ExpressionAttributeNames']['#tap_pk']
+        partition_value = params['ExpressionAttributeValues'][':tap_pk']
+        items = [item for item in self.items if item[partition_key] == partition_value]
+        return self._page(items, params)
+
+
+class FakeStreamsClient:
+    """A DynamoDB Streams client serving shards of {'ShardId', 'closed', 'records'} dicts."""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.read_shards = []
+
+    def describe_stream(self, StreamArn, **params):
+        return {'StreamDescription': {'Shards': [
+            {'ShardId': shard['ShardId'],
+             'SequenceNumberRange': {'EndingSequenceNumber': '9'} if shard.get('closed', True) else {}}
+            for shard in self.shards
+        ]}}
+
+    def get_shard_iterator(self, ShardId, **params):
+        return {'ShardIterator': ShardId}
+
+    def get_records(self, ShardIterator, Limit):
+        self.read_shards.append(ShardIterator)
+        shard = next(shard for shard in self.shards if shard['ShardId'] == ShardIterator)
+        return {'Records': shard['records']}
+
+
+def make_stream(config, client, state=None, name='table', replication_method=None, **kwargs):
+    """Returns a DynamicStream for name whose tap uses the given config and state."""
+    with mock.patch.object(TapDynamoDB, 'discover_streams', return_value=[]):
+        tap = TapDynamoDB(config={'region_name': 'us-east-1', **config}, state=state or {})
+    stream = DynamicStream(tap, name, schema={'properties': {}, 'type': 'object'},
+                           primary_keys=[key['AttributeName'] for key in client.table_info['KeySchema']],
+                           **kwargs)
+    if replication_method:
+        stream.forced_replication_method = replication_method
+    return stream
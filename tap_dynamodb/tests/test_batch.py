@@ -0,0 +1,154 @@
+"""Tests batch file chunking and encodings."""
+
+import gzip
+import io
+import json
+import os
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from singer_sdk.helpers._batch import JSONLinesEncoding
+
+from tap_dynamodb import batch
+from tap_dynamodb.tap import TapDynamoDB
+from tap_dynamodb.tests.fakes import FakeClient
+
+SCHEMA = {'type': 'object', 'properties': {
+    'id': {'type': ['integer', 'null']},
+    'score': {'type': ['number', 'null']},
+    'active': {'type': ['boolean', 'null']},
+    'name': {'type': ['string', 'null']},
+    'tags': {'type': ['array', 'null'], 'items': {'type': 'string'}},
+}}
+
+
+def _sizes(chunks):
+    return [len(chunk) for chunk in chunks]
+
+
+def test_chunk_records_caps_records():
+    records = [{'id': i} for i in range(5)]
+
+    assert _sizes(batch.chunk_records(records, 2, 1024)) == [2, 2, 1]
+
+
+def test_chunk_records_caps_bytes():
+    records = [{'id': i} for i in range(5)]
+    line, size = batch.json_line(records[0])
+    assert line == b'{"id": 0}\n'
+
+    assert _sizes(batch.chunk_records(records, 100, size * 2)) == [2, 2, 1]
+
+
+def test_chunk_records_oversized_record_gets_its_own_chunk():
+    records = [{'id': 'x' * 100}, {'id': 1}]
+
+    assert _sizes(batch.chunk_records(records, 100, 10)) == [1, 1]
+
+
+def test_chunk_records_custom_encode():
+    chunks = list(batch.chunk_records([1, 2, 3], 100, 2, lambda record: (record * 10, 1)))
+
+    assert chunks == [[10, 20], [30]]
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_write_jsonl_batch_file(compression):
+    encoding = JSONLinesEncoding(compression=compression)
+    lines = next(batch.chunk_records([{'n': Decimal('1.5')}], 10, 1024))
+    f = io.BytesIO()
+
+    batch.write_batch_file(f, encoding, lines)
+
+    data = f.getvalue()
+    if compression == 'gzip':
+        data = gzip.decompress(data)
+    assert json.loads(data) == {'n': 1.5}
+
+
+def test_parquet_files_share_the_stream_schema():
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    encoding = batch.ParquetEncoding(compression='snappy')
+    schema = batch.parquet_schema(SCHEMA)
+    encode = batch.parquet_row_encoder(SCHEMA)
+    records = [
+        {'id': Decimal('1'), 'score': Decimal('2'), 'active': True, 'name': 'a', 'tags': ['x']},
+        {'id': Decimal('2'), 'score': Decimal('2.5')},
+    ]
+
+    tables = []
+    for chunk in batch.chunk_records(records, 1, 1024, encode):
+        f = io.BytesIO()
+        batch.write_batch_file(f, encoding, chunk, schema)
+        tables.append(pyarrow.parquet.read_table(io.BytesIO(f.getvalue())))
+
+    assert [table.schema for table in tables] == [schema, schema]
+    assert schema.field('id').type == pyarrow.int64()
+    assert schema.field('score').type == pyarrow.float64()
+    assert schema.field('tags').type == pyarrow.string()
+    assert tables[0].to_pylist() == [{'id': 1, 'score': 2.0, 'active': True, 'name': 'a', 'tags': '["x"]'}]
+    assert tables[1].to_pylist() == [{'id': 2, 'score': 2.5, 'active': None, 'name': None, 'tags': None}]
+
+
+def test_parquet_row_sizes_are_estimated():
+    encode = batch.parquet_row_encoder(SCHEMA)
+
+    row, size = encode({'id': 1, 'name': 'abcd'})
+
+    assert size == 8 + 4
+    assert row['id'] == 1
+
+
+def test_split_records_streams_batches():
+    pulled = []
+
+    def records():
+        for i in range(5):
+            pulled.append(i)
+            yield {'id': i}
+
+    batches = batch.split_records(records(), 2, 1024)
+    first = next(batches)
+    assert pulled == [0]
+    assert next(first) == b'{"id": 0}\n'
+    assert pulled == [0]
+
+    assert [line for line in first] == [b'{"id": 1}\n']
+    assert [len(list(items)) for items in batches] == [2, 1]
+    assert pulled == [0, 1, 2, 3, 4]
+
+
+def test_batch_limits():
+    assert batch.batch_limits({}, JSONLinesEncoding()) == (batch.JSONL_MAX_RECORDS, batch.JSONL_MAX_BYTES)
+    assert batch.batch_limits({}, batch.ParquetEncoding()) == (batch.PARQUET_MAX_RECORDS, batch.PARQUET_MAX_BYTES)
+    assert batch.batch_limits({'batch_max_records': 5, 'batch_max_bytes': 10}, batch.ParquetEncoding()) == (5, 10)
+
+
+def test_get_batches_writes_jsonl_files(tmp_path):
+    table_info = {
+        'TableName': 'table',
+        'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'id', 'AttributeType': 'N'}],
+    }
+    client = FakeClient(table_info, [{'id': {'N': str(i)}} for i in range(5)])
+    config = {
+        'region_name': 'us-east-1',
+        'use_local_dynamo': True,
+        'batch_max_records': 2,
+        'batch_config': {'encoding': {'format': 'jsonl', 'compression': 'gzip'},
+                         'storage': {'root': f'file://{tmp_path}', 'prefix': 'out-'}},
+    }
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        stream = TapDynamoDB(config=config).streams['table']
+        manifests = [manifest for _, manifest in stream.get_batches(stream.get_batch_config(stream.config))]
+
+    assert len(manifests) == 3
+    ids = [
+        [json.loads(line)['id'] for line in gzip.open(os.path.join(tmp_path, os.path.basename(urls[0])))]
+        for urls in manifests
+    ]
+    assert ids == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,67 @@
+"""Tests the shared state and clients used by concurrently synced streams."""
+
+import json
+import threading
+from unittest import mock
+
+from tap_dynamodb import dynamodb
+from tap_dynamodb.tests.fakes import FakeClient, make_stream
+
+TABLE_INFO = {
+    'TableName': 'table',
+    'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+    'AttributeDefinitions': [{'AttributeName': 'id', 'AttributeType': 'S'}],
+}
+
+
+def _states(output):
+    return [message['value'] for message in map(json.loads, output.splitlines()) if message['type'] == 'STATE']
+
+
+def test_state_messages_hold_only_emitted_bookmarks_of_other_streams(capsys):
+    client = FakeClient(TABLE_INFO, [])
+    state = {'bookmarks': {'a': {}, 'b': {'finished_shards': ['old']}}}
+    stream_a = make_stream({}, client, state=state, name='a')
+    stream_b = make_stream({}, client, name='b')
+    stream_b._tap = stream_a._tap
+    stream_b._tap_state = stream_a._tap_state
+    # As at the start of sync_all, before any stream has made progress
+    assert stream_a._tap.emitted_bookmarks['b'] == {'finished_shards': ['old']}
+
+    # b is mid-sync, so its progress must not appear in a's STATE messages
+    stream_b.stream_state['shard_seq_numbers'] = {'shard': '5'}
+    stream_a.stream_state['success_timestamp'] = 'now'
+    stream_a._write_state_message()
+    stream_b._write_state_message()
+    stream_b.stream_state['shard_seq_numbers'] = {'shard': '9'}
+    stream_a._write_state_message()
+
+    assert _states(capsys.readouterr().out) == [
+        {'bookmarks': {'a': {'success_timestamp': 'now'}, 'b': {'finished_shards': ['old']}}},
+        {'bookmarks': {'a': {'success_timestamp': 'now'},
+                       'b': {'finished_shards': ['old'], 'shard_seq_numbers': {'shard': '5'}}}},
+        {'bookmarks': {'a': {'success_timestamp': 'now'},
+                       'b': {'finished_shards': ['old'], 'shard_seq_numbers': {'shard': '5'}}}},
+    ]
+
+
+def test_clients_are_created_once_and_shared():
+    created = []
+
+    def client(service_name, **kwargs):
+        created.append(service_name)
+        return object()
+
+    config = {'region_name': 'us-east-1'}
+    with mock.patch.dict(dynamodb._clients, clear=True), mock.patch('boto3.client', side_effect=client):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(dynamodb.get_client(config))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stream_client = dynamodb.get_stream_client(config)
+
+    assert created == ['dynamodb', 'dynamodbstreams']
+    assert len({id(client) for client in clients}) == 1
+    assert stream_client is not clients[0]
@@ -0,0 +1,81 @@
+"""Tests the digest index used for change detection."""
+
+from unittest import mock
+
+from tap_dynamodb.digest_index import DigestIndex
+from tap_dynamodb.tests.fakes import FakeClient, make_stream
+
+
+def _sync(directory, records, baseline_run_id=None, commit=True):
+    index = DigestIndex(directory, "table", baseline_run_id)
+    changed = index.filter_changed(records, ["id"])
+    deleted = list(index.deleted(["id"]))
+    if commit:
+        index.commit()
+    index.close()
+    return changed, deleted, index.run_id
+
+
+def test_emits_only_changes(tmp_path):
+    records = [{"id": str(i), "value": i} for i in range(3)]
+    changed, deleted, run_id = _sync(tmp_path, records)
+    assert (changed, deleted) == (records, [])
+
+    records = [{"id": "0", "value": 0}, {"id": "1", "value": 10}, {"id": "3", "value": 3}]
+    changed, deleted, run_id = _sync(tmp_path, records, run_id)
+    assert (changed, deleted) == (records[1:], [{"id": "2"}])
+
+    assert _sync(tmp_path, records, run_id)[:2] == ([], [])
+
+
+def test_uncommitted_run_is_discarded(tmp_path):
+    records = [{"id": "0", "value": 0}]
+    _, _, run_id = _sync(tmp_path, records)
+
+    assert _sync(tmp_path, [{"id": "0", "value": 1}], run_id, commit=False)[0] == [{"id": "0", "value": 1}]
+    assert _sync(tmp_path, [{"id": "0", "value": 1}], run_id)[0] == [{"id": "0", "value": 1}]
+
+
+def test_unacknowledged_run_is_not_the_baseline(tmp_path):
+    _, _, run_id = _sync(tmp_path, [{"id": "0", "value": 0}, {"id": "1", "value": 1}])
+
+    # Committed locally, but the state naming it never reached the target
+    _sync(tmp_path, [{"id": "0", "value": 5}], run_id)
+
+    changed, deleted, retry_run_id = _sync(tmp_path, [{"id": "0", "value": 5}], run_id)
+    assert (changed, deleted) == ([{"id": "0", "value": 5}], [{"id": "1"}])
+
+    # Only the baseline and the latest run are kept
+    index = DigestIndex(tmp_path, "table")
+    run_ids = [row[0] for row in index.connection.execute("SELECT DISTINCT run_id FROM digests ORDER BY run_id")]
+    index.close()
+    assert run_ids == [run_id, retry_run_id]
+
+
+def test_state_without_a_run_emits_everything(tmp_path):
+    records = [{"id": "0", "value": 0}]
+    _sync(tmp_path, records)
+
+    assert _sync(tmp_path, records) == (records, [], 2)
+
+
+def test_run_id_is_bookmarked_after_records(tmp_path):
+    table_info = {
+        'TableName': 'table',
+        'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        'AttributeDefinitions': [{'AttributeName': 'id', 'AttributeType': 'S'}],
+    }
+    client = FakeClient(table_info, [{'id': {'S': 'a'}}])
+    config = {'digest_index_dir': str(tmp_path), 'table_configs': {'table': {'change_detection': True}}}
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        stream = make_stream(config, client)
+        records = stream.change_detection_get_records()
+        assert next(records) == {'id': 'a'}
+        assert 'digest_run_id' not in stream.stream_state
+        assert list(records) == []
+        assert stream.stream_state['digest_run_id'] == 1
+
+        stream = make_stream(config, client, state={'bookmarks': {'table': {'digest_run_id': 1}}})
+        assert list(stream.change_detection_get_records()) == []
+        assert stream.stream_state['digest_run_id'] == 2
@@ -0,0 +1,158 @@
+"""Tests Scan filter and Query key condition pushdown."""
+
+import base64
+from unittest import mock
+
+import pytest
+
+from tap_dynamodb.sync_strategies import full_table
+from tap_dynamodb.tests.fakes import FakeClient, make_stream
+
+TABLE_INFO = {
+    'TableName': 'table',
+    'KeySchema': [{'AttributeName': 'tenant', 'KeyType': 'HASH'},
+                  {'AttributeName': 'ts', 'KeyType': 'RANGE'}],
+    'AttributeDefinitions': [{'AttributeName': 'tenant', 'AttributeType': 'S'},
+                             {'AttributeName': 'ts', 'AttributeType': 'N'}],
+}
+
+BINARY_TABLE_INFO = {
+    'TableName': 'table',
+    'KeySchema': [{'AttributeName': 'tenant', 'KeyType': 'HASH'},
+                  {'AttributeName': 'id', 'KeyType': 'RANGE'}],
+    'AttributeDefinitions': [{'AttributeName': 'tenant', 'AttributeType': 'S'},
+                             {'AttributeName': 'id', 'AttributeType': 'B'}],
+}
+
+
+def _items(tenants, count):
+    return [{'tenant': {'S': tenant}, 'ts': {'N': str(i)}} for tenant in tenants for i in range(count)]
+
+
+def test_build_query_params():
+    params = full_table.build_query_params(TABLE_INFO, {
+        'partition_key_values': ['a', 'b'],
+        'sort_key_range': {'start': '1', 'end': '5'},
+        'filter_expression': '#st = :st',
+        'expression_attribute_names': {'#st': 'status'},
+        'expression_attribute_values': {':st': {'S': 'active'}},
+    })
+
+    assert list(params) == ['a', 'b']
+    assert params['a'] == {
+        'FilterExpression': '#st = :st',
+        'KeyConditionExpression': '#tap_pk = :tap_pk AND #tap_sk BETWEEN :tap_sk_start AND :tap_sk_end',
+        'ExpressionAttributeNames': {'#st': 'status', '#tap_pk': 'tenant', '#tap_sk': 'ts'},
+        'ExpressionAttributeValues': {':st': {'S': 'active'}, ':tap_pk': {'S': 'a'},
+                                      ':tap_sk_start': {'N': '1'}, ':tap_sk_end': {'N': '5'}},
+    }
+    assert params['b']['ExpressionAttributeValues'][':tap_pk'] == {'S': 'b'}
+
+
+def test_build_query_params_binary_partition_key():
+    table_info = {**BINARY_TABLE_INFO, 'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}]}
+    encoded = base64.b64encode(b'\x00\x01').decode('utf-8')
+
+    params = full_table.build_query_params(table_info, {'partition_key_values': [encoded]})
+
+    assert params[encoded]['ExpressionAttributeValues'][':tap_pk'] == {'B': b'\x00\x01'}
+
+
+def test_build_scan_params():
+    assert full_table.build_scan_params(TABLE_INFO, {}) == {}
+    assert full_table.build_scan_params(TABLE_INFO, {'filter_expression': 'a = :a'}) == {'FilterExpression': 'a = :a'}
+
+    params = full_table.build_scan_params(TABLE_INFO, {'filter_expression': 'a = :a', 'sort_key_range': {'end': '3'}})
+    assert params['FilterExpression'] == '(a = :a) AND #tap_sk <= :tap_sk_end'
+    assert params['ExpressionAttributeValues'] == {':tap_sk_end': {'N': '3'}}
+
+
+def test_build_scan_params_sort_key_range_without_sort_key():
+    table_info = {**TABLE_INFO, 'KeySchema': TABLE_INFO['KeySchema'][:1]}
+    with pytest.raises(ValueError):
+        full_table.build_scan_params(table_info, {'sort_key_range': {'start': '1'}})
+
+
+def test_bookmark_key_round_trip():
+    key = {'tenant': {'S': 'a'}, 'id': {'B': b'\x00\xff'}}
+    bookmark = full_table.bookmark_key(key)
+
+    assert bookmark == {'tenant': {'S': 'a'}, 'id': {'B': 'AP8='}}
+    assert full_table.resume_key(bookmark) == key
+
+
+def test_query_partitions():
+    client = FakeClient(TABLE_INFO, _items(['a', 'b', 'c'], 5))
+    partition_params = full_table.build_query_params(TABLE_INFO, {'partition_key_values': ['a', 'b', 'c']})
+    start_keys = {'b': {'tenant': {'S': 'b'}, 'ts': {'N': '2'}}}
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        results = list(full_table.query_partitions('table', '', partition_params, start_keys, {}, 2))
+
+    items = {}
+    for partition_value, result in results:
+        items.setdefault(partition_value, []).extend(int(item['ts']['N']) for item in result['Items'])
+    assert items == {'a': [0, 1, 2, 3, 4], 'b': [3, 4], 'c': [0, 1, 2, 3, 4]}
+
+
+def test_query_partitions_raises_worker_errors():
+    client = FakeClient(TABLE_INFO, [])
+    client.query = mock.Mock(side_effect=RuntimeError('boom'))
+    partition_params = full_table.build_query_params(TABLE_INFO, {'partition_key_values': ['a']})
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        with pytest.raises(RuntimeError, match='boom'):
+            list(full_table.query_partitions('table', '', partition_params, {}, {}, 1))
+
+
+def test_query_partitions_stops_querying_after_a_failure():
+    client = FakeClient(TABLE_INFO, [])
+    client.query = mock.Mock(side_effect=RuntimeError('boom'))
+    values = [str(i) for i in range(50)]
+    partition_params = full_table.build_query_params(TABLE_INFO, {'partition_key_values': values})
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        with pytest.raises(RuntimeError, match='boom'):
+            list(full_table.query_partitions('table', '', partition_params, {}, {}, 2))
+
+    # Only the queries already running when the first one failed are sent
+    assert client.query.call_count <= 4
+
+
+def test_query_partitions_stops_querying_when_closed():
+    client = FakeClient(TABLE_INFO, _items(['a', 'b', 'c'], 20))
+    partition_params = full_table.build_query_params(TABLE_INFO, {'partition_key_values': ['a', 'b', 'c']})
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        results = full_table.query_partitions('table', '', partition_params, {}, {}, 1)
+        next(results)
+        results.close()
+
+    # The worker may have queued up to two more pages before noticing
+    assert len(client.requests) <= 3
+
+
+def test_partition_bookmarks_resume_binary_keys():
+    items = [{'tenant': {'S': tenant}, 'id': {'B': bytes([i])}} for tenant in 'ab' for i in range(5)]
+    client = FakeClient(BINARY_TABLE_INFO, items)
+    config = {'table_configs': {'table': {'partition_key_values': ['a', 'b'], 'query_concurrency': 1}}}
+    state = {'bookmarks': {'table': {
+        'finished_partition_keys': ['a'],
+        'partition_key_bookmarks': {'b': full_table.bookmark_key({'tenant': {'S': 'b'}, 'id': {'B': b'\x01'}})},
+    }}}
+
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        stream = make_stream(config, client, state=state)
+        records = stream.full_table_get_records()
+
+        assert next(records) == {'tenant': 'b', 'id': base64.b64encode(b'\x02').decode('utf-8')}
+        next(records)
+        next(records)
+        # The first page of the resumed partition is bookmarked once its items were emitted
+        assert stream.stream_state['partition_key_bookmarks'] == {'b': {'tenant': {'S': 'b'}, 'id': {'B': 'Aw=='}}}
+        assert list(records) == []
+
+    assert [params['ExpressionAttributeValues'][':tap_pk'] for _, params in client.requests] == [{'S': 'b'}] * 2
+    assert client.requests[0][1]['ExclusiveStartKey'] == {'tenant': {'S': 'b'}, 'id': {'B': b'\x01'}}
+    assert 'partition_key_bookmarks' not in stream.stream_state
+    assert 'finished_partition_keys' not in stream.stream_state
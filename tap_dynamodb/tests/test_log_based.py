@@ -0,0 +1,162 @@
+"""Tests the handoff from the initial full table sync to DynamoDB stream replay."""
+
+import datetime
+from unittest import mock
+
+import pytest
+
+from tap_dynamodb.deserialize import Deserializer
+from tap_dynamodb.sync_strategies import log_based
+from tap_dynamodb.tap import TapDynamoDB
+from tap_dynamodb.tests.fakes import FakeClient, FakeStreamsClient, make_stream
+
+TABLE_INFO = {
+    'TableName': 'table',
+    'LatestStreamArn': 'arn',
+    'KeySchema': [{'AttributeName': 'tenant', 'KeyType': 'HASH'},
+                  {'AttributeName': 'ts', 'KeyType': 'RANGE'}],
+    'AttributeDefinitions': [{'AttributeName': 'tenant', 'AttributeType': 'S'},
+                             {'AttributeName': 'ts', 'AttributeType': 'N'}],
+}
+
+
+def _item(tenant, ts):
+    return {'tenant': {'S': tenant}, 'ts': {'N': str(ts)}}
+
+
+def _insert(tenant, ts, sequence_number='1'):
+    return {'eventName': 'INSERT',
+            'dynamodb': {'Keys': _item(tenant, ts), 'NewImage': _item(tenant, ts), 'SequenceNumber': sequence_number}}
+
+
+def _sync(client, streams_client, state=None, config=None):
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client), \
+            mock.patch('tap_dynamodb.dynamodb.get_stream_client', return_value=streams_client):
+        stream = make_stream(config or {}, client, state=state, replication_method='LOG_BASED')
+        return list(stream.get_records(None)), stream.stream_state
+
+
+def test_initial_sync_bookmarks_shards_before_scan():
+    streams_client = FakeStreamsClient([
+        {'ShardId': 'closed', 'records': [_insert('a', 1)]},
+        {'ShardId': 'open', 'closed': False, 'records': []},
+    ])
+    client = FakeClient(TABLE_INFO, [_item('a', 1), _item('b', 2)])
+    calls = []
+    scan = client.scan
+    client.scan = lambda **params: calls.append('scan') or scan(**params)
+    get_initial_bookmarks = log_based.get_initial_bookmarks
+
+    def record_call(*args):
+        calls.append('get_initial_bookmarks')
+        return get_initial_bookmarks(*args)
+
+    with mock.patch.object(log_based, 'get_initial_bookmarks', side_effect=record_call):
+        records, state = _sync(client, streams_client)
+
+    assert calls == ['get_initial_bookmarks', 'scan']
+    assert records == [{'tenant': 'a', 'ts': 1}, {'tenant': 'b', 'ts': 2}]
+    # The closed shard's changes are already in the scan, so it is not replayed
+    assert streams_client.read_shards == []
+    assert state['initial_full_table_complete'] is True
+    assert state['finished_shards'] == ['closed']
+    assert state['success_timestamp']
+
+
+def test_later_sync_replays_only_new_shards():
+    streams_client = FakeStreamsClient([{'ShardId': 'old', 'records': [_insert('a', 1)]}])
+    client = FakeClient(TABLE_INFO, [_item('a', 1)])
+    _, state = _sync(client, streams_client)
+    client.requests.clear()
+
+    streams_client.shards = [
+        {'ShardId': 'old', 'records': [_insert('a', 1)]},
+        {'ShardId': 'new', 'records': [_insert('b', 2, '5')]},
+    ]
+    records, state = _sync(client, streams_client, state={'bookmarks': {'table': dict(state)}})
+
+    assert client.requests == []
+    assert streams_client.read_shards == ['new']
+    assert records == [{'tenant': 'b', 'ts': 2}]
+    assert state['finished_shards'] == ['old', 'new']
+    assert state['shard_seq_numbers'] == {}
+
+
+def test_finished_shards_no_longer_returned_are_pruned():
+    streams_client = FakeStreamsClient([{'ShardId': 'current', 'records': []}])
+    client = FakeClient(TABLE_INFO, [])
+    state = {'bookmarks': {'table': {
+        'initial_full_table_complete': True,
+        'success_timestamp': log_based.singer.utils.strftime(log_based.singer.utils.now()),
+        'finished_shards': ['expired', 'current'],
+    }}}
+
+    _, state = _sync(client, streams_client, state=state)
+
+    assert state['finished_shards'] == ['current']
+
+
+def test_aged_out_stream_rescans():
+    streams_client = FakeStreamsClient([])
+    client = FakeClient(TABLE_INFO, [_item('a', 1)])
+    state = {'bookmarks': {'table': {
+        'initial_full_table_complete': True,
+        'success_timestamp': '2000-01-01T00:00:00.000000Z',
+    }}}
+
+    records, _ = _sync(client, streams_client, state=state)
+
+    assert records == [{'tenant': 'a', 'ts': 1}]
+
+
+def test_interrupted_initial_scan_resumes():
+    streams_client = FakeStreamsClient([])
+    client = FakeClient(TABLE_INFO, [_item(tenant, ts) for tenant in 'ab' for ts in range(4)])
+    config = {'table_configs': {'table': {'partition_key_values': ['a', 'b'], 'query_concurrency': 1}}}
+    state = {'bookmarks': {'table': {
+        'finished_shards': [],
+        'finished_partition_keys': ['a'],
+        'partition_key_bookmarks': {'b': {'tenant': {'S': 'b'}, 'ts': {'N': '1'}}},
+    }}}
+
+    records, state = _sync(client, streams_client, state=state, config=config)
+
+    assert records == [{'tenant': 'b', 'ts': 2}, {'tenant': 'b', 'ts': 3}]
+    assert [params['ExclusiveStartKey'] for _, params in client.requests] == [{'tenant': {'S': 'b'}, 'ts': {'N': '1'}}]
+    assert state['initial_full_table_complete'] is True
+    assert 'partition_key_bookmarks' not in state
+
+
+def test_stream_records_outside_slice_are_skipped():
+    streams_client = FakeStreamsClient([])
+    client = FakeClient(TABLE_INFO, [_item('a', 1)])
+    config = {'table_configs': {'table': {'partition_key_values': ['a'], 'sort_key_range': {'end': '10'}}}}
+    _, state = _sync(client, streams_client, config=config)
+
+    streams_client.shards = [{'ShardId': 'new', 'records': [
+        _insert('a', 2, '1'), _insert('b', 2, '2'), _insert('a', 11, '3'),
+    ]}]
+    records, state = _sync(client, streams_client, state={'bookmarks': {'table': dict(state)}}, config=config)
+
+    assert records == [{'tenant': 'a', 'ts': 2}]
+    assert state['finished_shards'] == ['new']
+
+
+def test_filter_expression_is_rejected():
+    config = {'table_configs': {'table': {'filter_expression': 'a = :a'}}}
+    with pytest.raises(ValueError):
+        _sync(FakeClient(TABLE_INFO, []), FakeStreamsClient([]), config=config)
+
+
+def test_stream_deletes_keep_sdc_deleted_at():
+    client = FakeClient(TABLE_INFO, [_item('a', 1)])
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        tap = TapDynamoDB(config={'region_name': 'us-east-1', 'use_local_dynamo': True})
+        stream = tap.streams['table']
+
+    remove = {'eventName': 'REMOVE', 'dynamodb': {
+        'Keys': _item('a', 1), 'ApproximateCreationDateTime': datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)}}
+    record = stream.process_shard_record(remove, None, Deserializer())
+    messages = list(stream._generate_record_messages(record))
+
+    assert messages[0].record == {'tenant': 'a', 'ts': 1, '_sdc_deleted_at': '2023-01-01T00:00:00.000000Z'}
@@ -0,0 +1,29 @@
+"""Tests the limits used to schedule concurrently synced streams."""
+
+from tap_dynamodb import scheduler
+from tap_dynamodb.tap import TapDynamoDB
+from tap_dynamodb.tests.fakes import FakeClient, make_stream
+
+TABLE_INFO = {
+    'TableName': 'table',
+    'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+    'AttributeDefinitions': [{'AttributeName': 'id', 'AttributeType': 'S'}],
+}
+
+
+def test_estimate_memory_mb():
+    assert scheduler.estimate_memory_mb({}) == scheduler.ESTIMATED_PAGE_MEMORY_MB
+    assert scheduler.estimate_memory_mb({'partition_key_values': ['a'], 'query_concurrency': 2}) == \
+        scheduler.ESTIMATED_PAGE_MEMORY_MB * 6
+    assert scheduler.estimate_memory_mb({}, 10 * 1024 * 1024 + 1) == scheduler.ESTIMATED_PAGE_MEMORY_MB + 11
+
+
+def test_batch_buffer_is_reserved():
+    client = FakeClient(TABLE_INFO, [])
+    batch_config = {'encoding': {'format': 'jsonl'}, 'storage': {'root': 'file:///tmp'}}
+
+    assert TapDynamoDB._batch_buffer_bytes(make_stream({}, client)) == 0
+    assert TapDynamoDB._batch_buffer_bytes(make_stream({'batch_config': batch_config}, client)) == \
+        256 * 1024 * 1024
+    stream = make_stream({'batch_config': batch_config, 'batch_max_bytes': 1024}, client)
+    assert TapDynamoDB._batch_buffer_bytes(stream) == 1024
@@ -0,0 +1,204 @@
+"""Tests the spill cache and replaying table pages from it."""
+
+import base64
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from tap_dynamodb import spill_cache
+from tap_dynamodb.spill_cache import SpillCache
+from tap_dynamodb.tests.fakes import FakeClient, make_stream
+
+TABLE_INFO = {
+    'TableName': 'table',
+    'KeySchema': [{'AttributeName': 'tenant', 'KeyType': 'HASH'},
+                  {'AttributeName': 'id', 'KeyType': 'RANGE'}],
+    'AttributeDefinitions': [{'AttributeName': 'tenant', 'AttributeType': 'S'},
+                             {'AttributeName': 'id', 'AttributeType': 'B'}],
+}
+
+ITEMS = [{'tenant': {'S': tenant}, 'id': {'B': bytes([i])}} for tenant in 'ab' for i in range(3)]
+
+
+def _pages(count):
+    return [{'Items': [{'id': {'B': bytes([i])}}], 'LastEvaluatedKey': {'id': {'B': bytes([i])}}}
+            for i in range(count)]
+
+
+def _checkpoint(page):
+    return page['LastEvaluatedKey']['id']['B'][0]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SpillCache(str(tmp_path), retention_hours=1, max_bytes=1024 * 1024)
+
+
+def test_write_pages_completes_run(cache):
+    manifest = cache.new_run('run', 'table', 'fp')
+
+    assert list(cache.write_pages(manifest, _pages(3), _checkpoint)) == _pages(3)
+
+    manifest = cache.find_run('table', 'fp', 'run')
+    assert manifest['complete'] is True
+    assert manifest['checkpoint'] == 2
+    assert list(cache.read_pages(manifest)) == [{'Items': page['Items']} for page in _pages(3)]
+
+
+def test_write_pages_keeps_emitted_pages_when_stopped_early(cache):
+    manifest = cache.new_run('run', 'table', 'fp')
+    pages = cache.write_pages(manifest, iter(_pages(5)), _checkpoint)
+
+    next(pages), next(pages), next(pages)
+    pages.close()
+
+    # The third page was handed out but never acknowledged by a following request
+    manifest = cache.find_run('table', 'fp', 'run')
+    assert manifest['complete'] is False
+    assert manifest['checkpoint'] == 1
+    assert len(list(cache.read_pages(manifest))) == 2
+
+    # Resuming appends segments to the same run
+    assert len(list(cache.write_pages(manifest, _pages(5)[2:], _checkpoint))) == 3
+    manifest = cache.find_run('table', 'fp', 'run')
+    assert manifest['complete'] is True
+    assert len(manifest['segments']) == 2
+    assert [page['Items'] for page in cache.read_pages(manifest)] == [page['Items'] for page in _pages(5)]
+
+
+def test_write_pages_rolls_over_segments(cache):
+    manifest = cache.new_run('run', 'table', 'fp')
+    with mock.patch.object(spill_cache, 'SEGMENT_MAX_BYTES', 1):
+        list(cache.write_pages(manifest, _pages(3), _checkpoint))
+
+    assert len(cache.find_run('table', 'fp', 'run')['segments']) == 3
+
+
+def test_write_pages_stops_spilling_oversized_runs(tmp_path):
+    cache = SpillCache(str(tmp_path), retention_hours=1, max_bytes=10)
+    manifest = cache.new_run('run', 'table', 'fp')
+
+    assert list(cache.write_pages(manifest, _pages(3), _checkpoint)) == _pages(3)
+    assert cache.find_run('table', 'fp', 'run') is None
+
+
+def test_find_run(cache):
+    cache.new_run('run', 'table', 'fp')
+
+    assert cache.find_run('table', 'fp', None) is None
+    assert cache.find_run('table', 'other', 'run') is None
+    assert cache.find_run('other', 'fp', 'run') is None
+    assert cache.find_run('table', 'fp', 'missing') is None
+    # Interrupted runs can be replayed too
+    assert cache.find_run('table', 'fp', 'run')['complete'] is False
+
+
+def test_evict(tmp_path):
+    cache = SpillCache(str(tmp_path), retention_hours=1, max_bytes=1024 * 1024)
+    for run_id in ['expired', 'old', 'new', 'active']:
+        manifest = cache.new_run(run_id, 'table', 'fp')
+        list(cache.write_pages(manifest, _pages(50), _checkpoint))
+    for run_id, age in [('expired', 7200), ('old', 60), ('new', 0), ('active', 120)]:
+        manifest = cache.find_run('table', 'fp', run_id)
+        manifest['created_at'] = time.time() - age
+        cache._write_manifest(manifest)
+
+    run_bytes = cache.find_run('table', 'fp', 'new')['bytes']
+    cache.max_bytes = run_bytes * 2
+    with cache.hold('active'):
+        cache.evict()
+
+    assert sorted(os.listdir(tmp_path)) == ['active', 'new']
+
+
+def _sync(tmp_path, client, state=None, config=None, limit=None):
+    config = {'spill_cache_dir': str(tmp_path), **(config or {})}
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        stream = make_stream(config, client, state=state)
+        records = stream.full_table_get_records()
+        emitted = [record for _, record in zip(range(limit), records)] if limit else list(records)
+        records.close()
+        return emitted, dict(stream.stream_state)
+
+
+def test_stateless_sync_does_not_replay(tmp_path):
+    client = FakeClient(TABLE_INFO, ITEMS)
+    _sync(tmp_path, client)
+    client.requests.clear()
+
+    records, state = _sync(tmp_path, client)
+
+    assert len(records) == 6
+    assert len(client.requests) == 3
+    assert state == {}
+
+
+def test_interrupted_scan_replays_then_continues(tmp_path):
+    client = FakeClient(TABLE_INFO, ITEMS)
+    # Stop after the first record of the third page, once two pages were spilled
+    _, state = _sync(tmp_path, client, limit=5)
+    client.requests.clear()
+
+    records, state = _sync(tmp_path, client, state={'bookmarks': {'table': state}})
+
+    assert len(records) == 6
+    assert [params.get('ExclusiveStartKey') for _, params in client.requests] == [
+        {'tenant': {'S': 'b'}, 'id': {'B': b'\x00'}}
+    ]
+    assert state == {}
+
+
+def test_interrupted_query_replays_then_continues(tmp_path):
+    client = FakeClient(TABLE_INFO, ITEMS)
+    config = {'table_configs': {'table': {'partition_key_values': ['a', 'b'], 'query_concurrency': 1}}}
+    _, state = _sync(tmp_path, client, config=config, limit=3)
+    assert state['partition_key_bookmarks'] == {'a': {'tenant': {'S': 'a'}, 'id': {'B': 'AQ=='}}}
+    client.requests.clear()
+
+    # The state which reached the target may lag the spilled pages, the checkpoint is used instead
+    state.pop('partition_key_bookmarks')
+    records, state = _sync(tmp_path, client, state={'bookmarks': {'table': state}}, config=config)
+
+    assert [(record['tenant'], base64.b64decode(record['id'])[0]) for record in records] == \
+        [(tenant, i) for tenant in 'ab' for i in range(3)]
+    assert [(params['ExpressionAttributeValues'][':tap_pk'], params.get('ExclusiveStartKey'))
+            for _, params in client.requests] == [
+        ({'S': 'a'}, {'tenant': {'S': 'a'}, 'id': {'B': b'\x01'}}),
+        ({'S': 'b'}, None),
+        ({'S': 'b'}, {'tenant': {'S': 'b'}, 'id': {'B': b'\x01'}}),
+    ]
+    assert state == {}
+
+
+def test_complete_replay_clears_partition_bookmarks(tmp_path):
+    client = FakeClient(TABLE_INFO, ITEMS)
+    config = {'table_configs': {'table': {'partition_key_values': ['a', 'b'], 'query_concurrency': 1}}}
+    with mock.patch('tap_dynamodb.dynamodb.get_client', return_value=client):
+        stream = make_stream({'spill_cache_dir': str(tmp_path), **config}, client)
+        records = stream.full_table_get_records()
+        list(records)
+    run_id = os.listdir(tmp_path)[0]
+    client.requests.clear()
+
+    # The final state never reached the target, which last saw an interim state
+    state = {'spill_cache_run': run_id, 'finished_partition_keys': ['a'],
+             'partition_key_bookmarks': {'b': {'tenant': {'S': 'b'}, 'id': {'B': 'AA=='}}}}
+    records, state = _sync(tmp_path, client, state={'bookmarks': {'table': state}}, config=config)
+
+    assert len(records) == 6
+    assert client.requests == []
+    assert state == {}
+
+
+def test_resumed_query_is_not_spilled(tmp_path):
+    client = FakeClient(TABLE_INFO, ITEMS)
+    config = {'table_configs': {'table': {'partition_key_values': ['a', 'b'], 'query_concurrency': 1}}}
+    state = {'finished_partition_keys': ['a']}
+
+    records, state = _sync(tmp_path, client, state={'bookmarks': {'table': state}}, config=config)
+
+    assert len(records) == 3
+    assert os.listdir(tmp_path) == []
+    assert state == {}